@@ -5,7 +5,13 @@
 #   1TF4H    — зона + свечной паттерн (pin-bar или engulfing) только на 4H
 #   1TF1D    — зона + свечной паттерн (pin-bar или engulfing) только на 1D
 
-import os, time, json, requests, math
+import os, sys, time, json, signal, threading, requests, math
+from array import array
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
 from typing import List, Dict, Optional
 from datetime import datetime
 
@@ -28,11 +34,45 @@ DEM_OS_1D        = float(os.getenv("DEM_OS_1D", "0.29"))
 KLINE_4H         = os.getenv("KLINE_4H", "4h")
 KLINE_1D         = os.getenv("KLINE_1D", "1d")
 
+# Процессы для расчёта DeMarker/паттернов (0 — считать в основном процессе).
+# При EVAL_WORKERS > 0 Bybit-тикеры (без лимитов TwelveData) идут пачками до
+# EVAL_BATCH тикеров за цикл, загрузка в BB_FETCH_THREADS потоков, расчёт в пуле.
+# В пачку попадают только тикеры, у которых могла закрыться новая свеча 4H/1D.
+# Память: тикер ≈ 2 ТФ × 599 × 5 × 8 байт ≈ 48 КБ; в /dev/shm одновременно не больше
+# 2 × EVAL_WORKERS сегментов по EVAL_CHUNK тикеров (по умолчанию 50 -> ~2.4 МБ каждый).
+# Если места в /dev/shm не хватает — кусок считается в основном процессе.
+EVAL_WORKERS     = int(os.getenv("EVAL_WORKERS", "0"))
+EVAL_BATCH       = int(os.getenv("EVAL_BATCH", "500"))
+EVAL_CHUNK       = int(os.getenv("EVAL_CHUNK", "50"))
+BB_FETCH_THREADS = int(os.getenv("BB_FETCH_THREADS", "8"))
+SHM_DIR          = "/dev/shm"
+
 POLL_SECONDS     = 60  # сейчас не используется как раньше, но оставлен для совместимости
 
 BYBIT_BASE       = os.getenv("BYBIT_BASE", "https://api.bybit.com")
 BB_KLINES        = f"{BYBIT_BASE}/v5/market/kline"
+BB_INSTRUMENTS   = f"{BYBIT_BASE}/v5/market/instruments-info"
+BB_TICKERS       = f"{BYBIT_BASE}/v5/market/tickers"
 BB_TIMEOUT       = 15
+BB_RETRIES       = int(os.getenv("BB_RETRIES", "2"))        # повторы на 429 / 5xx / таймаут
+BB_BACKOFF       = float(os.getenv("BB_BACKOFF", "1.0"))    # пауза перед повтором, x2 на каждый
+
+# Вселенная тикеров: static — списки ниже, bybit — все линейные USDT-перпы,
+# file — символы из локального файла (по одному в строке, "KIND SYMBOL" или "SYMBOL")
+UNIVERSE_MODE    = os.getenv("UNIVERSE_MODE", "static").lower()
+UNIVERSE_FILE    = os.getenv("UNIVERSE_FILE", "/data/universe.txt")
+UNIVERSE_TTL     = int(os.getenv("UNIVERSE_TTL", "3600"))
+UNIVERSE_RETRY   = int(os.getenv("UNIVERSE_RETRY", "60"))  # повтор после неудачного обновления
+
+# Префильтр по одному bulk-запросу tickers: неликвидные и "стоящие" инструменты
+# не доходят до запроса свечей 4H/1D. Оба порога 0 — префильтр (и запрос) выключен
+PREFILTER_MIN_TURNOVER = float(os.getenv("PREFILTER_MIN_TURNOVER", "0"))
+PREFILTER_MIN_CHANGE   = float(os.getenv("PREFILTER_MIN_CHANGE", "0"))
+PREFILTER_TTL          = int(os.getenv("PREFILTER_TTL", "300"))
+PREFILTER_ON           = PREFILTER_MIN_TURNOVER > 0 or PREFILTER_MIN_CHANGE > 0
+
+UNIVERSE_CACHE: Dict = {"ts": 0.0, "ttl": 0, "plan": []}
+TICKERS_CACHE: Dict = {"ts": 0.0, "data": {}}
 
 # TwelveData
 TD_API_KEY       = os.getenv("TWELVEDATA_API_KEY", "")
@@ -48,6 +88,191 @@ TD_REFRESH_1D    = int(os.getenv("TD_REFRESH_1D", "43200"))
 TD_CACHE: Dict = {}
 TD_RATE = {"minute_start": 0.0, "minute_count": 0}
 
+# Профилировщик: включается без рестарта — SIGUSR1 (переключение) или наличие PROFILE_FLAG_FILE.
+# Если цикл дольше PROFILE_SLOW_SECONDS — пишем collapsed-стеки (flamegraph.pl / speedscope)
+PROFILE_FLAG_FILE    = os.getenv("PROFILE_FLAG_FILE", "/data/profile.on")
+PROFILE_DIR          = os.getenv("PROFILE_DIR", "/data/profiles")
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "60"))
+PROFILE_SAMPLE_MS    = int(os.getenv("PROFILE_SAMPLE_MS", "10"))
+PROFILE_KEEP         = int(os.getenv("PROFILE_KEEP", "20"))  # сколько последних дампов хранить
+
+# ================= CLOCK =====================
+
+class Clock:
+    """
+    Настенные часы. Все расписания, лимиты и дедуп берут время отсюда,
+    в режиме симуляции (sim.py) CLOCK подменяется на SimClock.
+    """
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def day(self) -> str:
+        return time.strftime("%Y%m%d", time.gmtime(self.time()))
+
+CLOCK: Clock = Clock()
+
+# ================= PROFILER =====================
+
+PROF: Dict = {
+    "on": False,          # активен в текущем цикле
+    "signal_on": False,   # переключается по SIGUSR1
+    "signal_seen": False, # последнее залогированное значение signal_on
+    "stack": [],          # [имя, старт, время детей]
+    "spans": {},          # "a;b;c" -> собственное время, мкс
+    "samples": {},        # "file:func;..." -> число сэмплов
+    "tags": {},           # тег спана (тикер) -> полное время, сек
+    "sampler": None,
+    "cycle": 0,
+    "cycle_start": 0.0,
+}
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("name", "tag")
+
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+
+    def __enter__(self):
+        PROF["stack"].append([self.name, time.perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, *exc):
+        stack = PROF["stack"]
+        if not stack:
+            return False
+        name, t0, child = stack.pop()
+        total = time.perf_counter() - t0
+        path = ";".join([x[0] for x in stack] + [name])
+        spans = PROF["spans"]
+        spans[path] = spans.get(path, 0) + int((total - child) * 1e6)
+        if stack:
+            stack[-1][2] += total
+        if self.tag is not None:
+            tags = PROF["tags"]
+            tags[self.tag] = tags.get(self.tag, 0.0) + total
+        return False
+
+def span(name: str, tag: Optional[str] = None):
+    """
+    Участок для трассировки. name — фиксированное имя (узел flamegraph),
+    tag — необязательная метка (тикер), время по ней копится отдельно.
+    Когда профилирование выключено — общий no-op объект.
+    """
+    if not PROF["on"] or threading.current_thread() is not threading.main_thread():
+        return _NULL_SPAN
+    return _Span(name, tag)
+
+def _prof_sampler(main_id: int, interval: float):
+    me = threading.current_thread()
+    while PROF["sampler"] is me:
+        frame = sys._current_frames().get(main_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if names:
+            key = ";".join(reversed(names))
+            PROF["samples"][key] = PROF["samples"].get(key, 0) + 1
+        time.sleep(interval)
+
+def _prof_toggle(signum, frame):
+    # только флаг: print из обработчика сигнала может попасть в reentrant-запись в stdout
+    PROF["signal_on"] = not PROF["signal_on"]
+
+def install_profiler_signal():
+    try:
+        signal.signal(signal.SIGUSR1, _prof_toggle)
+    except:
+        pass
+
+def prof_cycle_begin():
+    """
+    Начало цикла: синхронизируем вкл/выкл (сигнал или флаг-файл), чистим буферы.
+    """
+    if PROF["signal_on"] != PROF["signal_seen"]:
+        PROF["signal_seen"] = PROF["signal_on"]
+        print(f"INFO: profiler signal toggle -> {PROF['signal_on']}", flush=True)
+    want = PROF["signal_on"] or os.path.exists(PROFILE_FLAG_FILE)
+    if want and PROF["sampler"] is None and PROFILE_SAMPLE_MS > 0:
+        t = threading.Thread(
+            target=_prof_sampler,
+            args=(threading.main_thread().ident, PROFILE_SAMPLE_MS / 1000.0),
+            daemon=True
+        )
+        PROF["sampler"] = t
+        t.start()
+    elif not want:
+        PROF["sampler"] = None
+    PROF["on"] = want
+    PROF["stack"] = []
+    PROF["spans"] = {}
+    PROF["samples"] = {}
+    PROF["tags"] = {}
+    PROF["cycle"] += 1
+    PROF["cycle_start"] = CLOCK.time()
+
+def _write_collapsed(path: str, data: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        for k, v in sorted(data.items()):
+            if v > 0:
+                f.write(f"{k} {v}\n")
+    os.replace(tmp, path)
+
+def _prof_prune(keep: int):
+    """
+    Оставляем только keep последних дампов (имена cycle-<время>.<мс>-<N>.* сортируются по времени).
+    """
+    files = [x for x in os.listdir(PROFILE_DIR) if x.startswith("cycle-") and x.count(".") >= 2]
+    base_of = lambda x: ".".join(x.split(".")[:2])
+    bases = sorted(set(base_of(x) for x in files))
+    old = set(bases[:-keep]) if keep > 0 else set(bases)
+    for x in files:
+        if base_of(x) in old:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, x))
+            except:
+                pass
+
+def prof_cycle_end():
+    """
+    Конец цикла: если цикл (по CLOCK) медленнее порога — дамп спанов (мкс) и сэмплов.
+    """
+    if not PROF["on"]:
+        return
+    elapsed = CLOCK.time() - PROF["cycle_start"]
+    if elapsed < PROFILE_SLOW_SECONDS:
+        return
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}"
+        base = os.path.join(PROFILE_DIR, f"cycle-{stamp}-{PROF['cycle']}")
+        _write_collapsed(base + ".spans.folded", PROF["spans"])
+        if PROF["samples"]:
+            _write_collapsed(base + ".samples.folded", PROF["samples"])
+        if PROF["tags"]:
+            with open(base + ".symbols.txt", "w") as f:
+                for k, v in sorted(PROF["tags"].items(), key=lambda x: -x[1]):
+                    f.write(f"{k} {v:.6f}\n")
+        _prof_prune(PROFILE_KEEP)
+        print(f"INFO: slow cycle {elapsed:.1f}s, profile -> {base}.*", flush=True)
+    except:
+        pass
+
 # ================= STATE =====================
 
 def load_state(path: str) -> Dict:
@@ -68,7 +293,7 @@ def save_state(path: str, data: Dict):
         pass
 
 def gc_state(state: Dict, days=21):
-    cutoff = int(time.time()) - days*86400
+    cutoff = int(CLOCK.time()) - days*86400
     sent = state.get("sent", {})
     for k, v in list(sent.items()):
         if isinstance(v, int) and v < cutoff:
@@ -77,7 +302,7 @@ def gc_state(state: Dict, days=21):
     if "last_debug" not in state:
         state["last_debug"] = 0
     if "td_day" not in state:
-        state["td_day"] = time.strftime("%Y%m%d", time.gmtime())
+        state["td_day"] = CLOCK.day()
     if "td_count" not in state:
         state["td_count"] = 0
     # индекс обхода плана тикеров для циклического опроса
@@ -88,21 +313,21 @@ STATE = load_state(STATE_PATH)
 
 def _init_td_state():
     if "td_day" not in STATE or "td_count" not in STATE:
-        STATE["td_day"] = time.strftime("%Y%m%d", time.gmtime())
+        STATE["td_day"] = CLOCK.day()
         STATE["td_count"] = 0
 
 def _td_can_request() -> bool:
     if not TD_API_KEY:
         return False
     _init_td_state()
-    now = time.time()
+    now = CLOCK.time()
     ms = TD_RATE["minute_start"]
     if (now - ms) >= 60:
         TD_RATE["minute_start"] = now
         TD_RATE["minute_count"] = 0
     if TD_RATE["minute_count"] >= TD_MINUTE_LIMIT:
         return False
-    cur_day = time.strftime("%Y%m%d", time.gmtime())
+    cur_day = CLOCK.day()
     if STATE.get("td_day") != cur_day:
         STATE["td_day"] = cur_day
         STATE["td_count"] = 0
@@ -111,12 +336,12 @@ def _td_can_request() -> bool:
     return True
 
 def _td_mark_request():
-    now = time.time()
+    now = CLOCK.time()
     if TD_RATE["minute_start"] == 0:
         TD_RATE["minute_start"] = now
         TD_RATE["minute_count"] = 0
     TD_RATE["minute_count"] += 1
-    cur_day = time.strftime("%Y%m%d", time.gmtime())
+    cur_day = CLOCK.day()
     if STATE.get("td_day") != cur_day:
         STATE["td_day"] = cur_day
         STATE["td_count"] = 0
@@ -137,7 +362,7 @@ def fetch_td_candles(symbol: str, interval: str):
     if not TD_API_KEY:
         return None
     key = (symbol, interval)
-    now = time.time()
+    now = CLOCK.time()
     refresh = TD_REFRESH_4H if interval == "4h" else TD_REFRESH_1D
     if key in TD_CACHE:
         ts0, data = TD_CACHE[key]
@@ -155,10 +380,12 @@ def fetch_td_candles(symbol: str, interval: str):
             "apikey": TD_API_KEY,
             "timezone": "Etc/UTC",
         }
-        r = requests.get(f"{TD_BASE}/time_series", params=params, timeout=TD_TIMEOUT)
+        with span("td_http"):
+            r = requests.get(f"{TD_BASE}/time_series", params=params, timeout=TD_TIMEOUT)
         if r.status_code != 200:
             return None
-        j = r.json()
+        with span("json"):
+            j = r.json()
         if j.get("status") != "ok":
             return None
         values = j.get("values") or []
@@ -206,13 +433,15 @@ def tg_send_one(cid: str, text: str) -> bool:
 
 def _broadcast_signal(text: str, key: str) -> bool:
     chats = _chat_tokens()
-    ts = int(time.time())
+    ts = int(CLOCK.time())
     sent_any = False
     for cid in chats:
         k2 = f"{key}|{cid}"
         if STATE["sent"].get(k2):
             continue
-        if tg_send_one(cid, text):
+        with span("telegram"):
+            ok = tg_send_one(cid, text)
+        if ok:
             STATE["sent"][k2] = ts
             sent_any = True
     return sent_any
@@ -230,14 +459,48 @@ def closed_ohlc(ohlc: Optional[List[List[float]]]):
 
 # ================= INDICATORS =====================
 
+class FlatOHLC:
+    """
+    Свечи [ts, o, h, l, c] поверх плоского float64-буфера (memoryview "d"),
+    без списков списков. o[i] — строка из 5 float, column(j) — столбец целиком.
+    """
+    __slots__ = ("mv", "off", "n")
+
+    def __init__(self, mv, off: int, n: int):
+        self.mv = mv
+        self.off = off
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        p = (self.off + i) * 5
+        return self.mv[p:p + 5].tolist()
+
+    def column(self, j: int) -> List[float]:
+        p = self.off * 5
+        return self.mv[p + j:p + self.n * 5:5].tolist()
+
 def demarker_series(o, length):
     """
     DeMarker считается по массиву уже закрытых свечей (минус первые и далее).
+    o — список строк OHLC или FlatOHLC.
     """
     if not o or len(o) < length + 1:
         return None
-    highs = [x[2] for x in o]
-    lows  = [x[3] for x in o]
+    if isinstance(o, FlatOHLC):
+        highs = o.column(2)
+        lows  = o.column(3)
+    else:
+        highs = [x[2] for x in o]
+        lows  = [x[3] for x in o]
     up = [0.0]; dn = [0.0]
     for i in range(1, len(o)):
         up.append(max(highs[i] - highs[i-1], 0.0))
@@ -475,17 +738,32 @@ def format_signal(symbol, sig, zone, src):
 
 # ================= BYBIT =====================
 
+def _bb_get(url, params):
+    """
+    GET к Bybit с повторами: 429 / 5xx / сетевая ошибка -> пауза BB_BACKOFF * 2^i.
+    """
+    for attempt in range(BB_RETRIES + 1):
+        if attempt:
+            with span("backoff"):
+                CLOCK.sleep(BB_BACKOFF * 2 ** (attempt - 1))
+        try:
+            with span("bb_http"):
+                r = requests.get(url, params=params, timeout=BB_TIMEOUT)
+        except requests.RequestException:
+            continue
+        if r.status_code == 429 or r.status_code >= 500:
+            continue
+        return r
+    return None
+
 def fetch_bybit_klines(symbol, interval, category, limit=600):
     iv = "240" if interval == "4h" else ("D" if interval == "1d" else interval)
     try:
-        r = requests.get(
-            BB_KLINES,
-            params={"category": category, "symbol": symbol, "interval": iv, "limit": limit},
-            timeout=BB_TIMEOUT
-        )
-        if r.status_code != 200:
+        r = _bb_get(BB_KLINES, {"category": category, "symbol": symbol, "interval": iv, "limit": limit})
+        if r is None or r.status_code != 200:
             return None
-        lst = (r.json().get("result") or {}).get("list") or []
+        with span("json"):
+            lst = (r.json().get("result") or {}).get("list") or []
         out = []
         for k in lst:
             ts = int(k[0]); ts = ts // 1000 if ts > 10**12 else ts
@@ -575,7 +853,7 @@ def fetch_other(sym, interval):
 
 # ================= PLAN =====================
 
-def build_plan():
+def static_plan():
     plan = []
     for x in CRYPTO:     plan.append(("CRYPTO", x))
     for x in INDEX_PERP: plan.append(("OTHER", x))
@@ -586,37 +864,232 @@ def build_plan():
     for x in RU_STOCKS:  plan.append(("OTHER", x))
     return plan
 
-# ================= CORE =====================
+def fetch_bybit_linear_perps() -> Optional[List[str]]:
+    """
+    Все торгуемые линейные USDT-перпы Bybit (instruments-info, с пагинацией).
+    """
+    out = []
+    cursor = ""
+    try:
+        for _ in range(20):
+            params = {"category": "linear", "limit": 1000}
+            if cursor:
+                params["cursor"] = cursor
+            r = requests.get(BB_INSTRUMENTS, params=params, timeout=BB_TIMEOUT)
+            if r.status_code != 200:
+                return None
+            res = r.json().get("result") or {}
+            for it in res.get("list") or []:
+                if it.get("status") != "Trading":
+                    continue
+                if it.get("contractType") != "LinearPerpetual":
+                    continue
+                if it.get("quoteCoin") != "USDT":
+                    continue
+                sym = it.get("symbol") or ""
+                if sym.endswith("USDT"):
+                    out.append(sym)
+            cursor = res.get("nextPageCursor") or ""
+            if not cursor:
+                break
+    except:
+        return None
+    return out or None
 
-def process_symbol(kind, name):
+def load_universe_file(path: str) -> Optional[List]:
+    try:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()
+    except:
+        return None
+    plan = []
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].upper() in ("CRYPTO", "OTHER"):
+            plan.append((parts[0].upper(), parts[1].upper()))
+        else:
+            plan.append(("OTHER", parts[0].upper()))
+    return plan or None
+
+def discover_universe() -> Optional[List]:
+    """
+    Полный план без префильтра. Для bybit: статические не-Bybit тикеры
+    (акции, FX, RU) + все линейные перпы, без дублей с CRYPTO.
+    None — если источник (файл / instruments-info) недоступен.
+    """
+    if UNIVERSE_MODE == "file":
+        return load_universe_file(UNIVERSE_FILE)
+    if UNIVERSE_MODE != "bybit":
+        return static_plan()
 
-    # Запрос сырых свечей (включая текущую нулевую)
-    if kind == "CRYPTO":
-        k4_raw, n4, s4 = fetch_crypto(name, KLINE_4H)
-        k1_raw, n1, s1 = fetch_crypto(name, KLINE_1D)
+    perps = fetch_bybit_linear_perps()
+    if not perps:
+        return None
+    plan = static_plan()
+    seen = set(name for _, name in plan)
+    seen.update(base + "USDT" for base in CRYPTO)
+    for sym in perps:
+        if sym not in seen:
+            seen.add(sym)
+            plan.append(("OTHER", sym))
+    return plan
+
+def cached_universe() -> List:
+    """
+    Вселенная с кэшем на UNIVERSE_TTL. При сбое обновления оставляем прежний план
+    (или static, если ещё ничего не найдено) и повторяем через UNIVERSE_RETRY.
+    """
+    now = CLOCK.time()
+    if UNIVERSE_CACHE["plan"] and (now - UNIVERSE_CACHE["ts"]) < UNIVERSE_CACHE["ttl"]:
+        return UNIVERSE_CACHE["plan"]
+    plan = discover_universe()
+    UNIVERSE_CACHE["ts"] = now
+    if plan:
+        UNIVERSE_CACHE["ttl"] = UNIVERSE_TTL
+        UNIVERSE_CACHE["plan"] = plan
     else:
-        k4_raw, n4, s4 = fetch_other(name, KLINE_4H)
-        k1_raw, n1, s1 = fetch_other(name, KLINE_1D)
+        print(f"WARN: universe discovery failed ({UNIVERSE_MODE}), retry in {UNIVERSE_RETRY}s", flush=True)
+        UNIVERSE_CACHE["ttl"] = UNIVERSE_RETRY
+        if not UNIVERSE_CACHE["plan"]:
+            UNIVERSE_CACHE["plan"] = static_plan()
+    return UNIVERSE_CACHE["plan"]
+
+def fetch_bybit_tickers() -> Dict:
+    """
+    Один bulk-запрос tickers (linear): {symbol: (turnover24h, |change24h|)}.
+    При ошибке — последние закэшированные данные.
+    """
+    now = CLOCK.time()
+    if TICKERS_CACHE["data"] and (now - TICKERS_CACHE["ts"]) < PREFILTER_TTL:
+        return TICKERS_CACHE["data"]
+    try:
+        r = requests.get(BB_TICKERS, params={"category": "linear"}, timeout=BB_TIMEOUT)
+        if r.status_code != 200:
+            return TICKERS_CACHE["data"]
+        lst = (r.json().get("result") or {}).get("list") or []
+        data = {}
+        for t in lst:
+            try:
+                turnover = float(t.get("turnover24h") or 0)
+                change = abs(float(t.get("price24hPcnt") or 0))
+            except:
+                continue
+            data[t.get("symbol")] = (turnover, change)
+        if data:
+            TICKERS_CACHE["ts"] = now
+            TICKERS_CACHE["data"] = data
+    except:
+        pass
+    return TICKERS_CACHE["data"]
+
+def prefilter_ok(kind, name, tickers: Dict) -> bool:
+    """
+    Первая (дешёвая) стадия: по bulk tickers отбрасываем Bybit-инструменты
+    с оборотом < PREFILTER_MIN_TURNOVER или |изменением за 24ч| < PREFILTER_MIN_CHANGE.
+    TwelveData-тикеры и символы, которых нет в tickers (спот-фолбэк), проходят как есть.
+    """
+    sym = name + "USDT" if kind == "CRYPTO" else name
+    t = tickers.get(sym)
+    if t is None:
+        return True
+    turnover, change = t
+    return turnover >= PREFILTER_MIN_TURNOVER and change >= PREFILTER_MIN_CHANGE
+
+def build_plan():
+    return cached_universe()
+
+def plan_cursor(plan: List, idx: int, name: Optional[str]) -> int:
+    """
+    Позиция курсора после обновления вселенной: по имени следующего тикера,
+    если его индекс сдвинулся, иначе по сохранённому индексу.
+    """
+    n = len(plan)
+    if name and not (idx < n and plan[idx][1] == name):
+        for i, (_, x) in enumerate(plan):
+            if x == name:
+                return i
+    return idx if idx < n else 0
+
+def pick_symbols(plan: List, idx: int, count: int, skip=None):
+    """
+    Следующие count тикеров по кругу со сдвигом курсора; отсеянные префильтром
+    (и skip(kind, name), если задан) пропускаются в момент выбора
+    (не больше одного круга за вызов).
+    """
+    tickers = fetch_bybit_tickers() if PREFILTER_ON else None
+    n = len(plan)
+    items = []
+    seen = 0
+    while len(items) < count and seen < n:
+        kind, name = plan[idx]
+        idx = (idx + 1) % n
+        seen += 1
+        if tickers and not prefilter_ok(kind, name, tickers):
+            continue
+        if skip is not None and skip(kind, name):
+            continue
+        items.append((kind, name))
+    return items, idx
+
+def take_next(plan: List, key: str, count: int, skip=None) -> List:
+    """
+    pick_symbols с курсором в STATE: <key>_idx (индекс) и <key>_next (имя следующего).
+    """
+    idx = plan_cursor(plan, STATE.get(f"{key}_idx", 0), STATE.get(f"{key}_next"))
+    items, idx = pick_symbols(plan, idx, count, skip)
+    STATE[f"{key}_idx"] = idx
+    STATE[f"{key}_next"] = plan[idx][1]
+    return items
+
+# ================= CORE =====================
+
+def fetch_symbol(kind, name) -> Optional[Dict]:
+    """
+    Стадия загрузки: сырые свечи 4H/1D -> только закрытые.
+    None — если данных нет ни на одном ТФ.
+    """
+    # Запрос сырых свечей (включая текущую нулевую)
+    fetch = fetch_crypto if kind == "CRYPTO" else fetch_other
+    with span("fetch 4H"):
+        k4_raw, n4, s4 = fetch(name, KLINE_4H)
+    with span("fetch 1D"):
+        k1_raw, n1, s1 = fetch(name, KLINE_1D)
 
     have4 = bool(k4_raw); have1 = bool(k1_raw)
     if not have4 and not have1:
         print(f"WARN: no data for {name} ({kind})", flush=True)
-        return False
+        return None
 
     # Обрезаем нулевую свечу: работаем только по закрытым
     k4 = closed_ohlc(k4_raw) if have4 else None
     k1 = closed_ohlc(k1_raw) if have1 else None
 
-    if have4 and not k4: have4 = False
-    if have1 and not k1: have1 = False
-
-    if not have4 and not have1:
+    if not k4 and not k1:
         print(f"WARN: no closed bars for {name} ({kind})", flush=True)
-        return False
+        return None
+
+    return {
+        "name": name,
+        "k4": k4 or None,
+        "k1": k1 or None,
+        "sym": n4 or n1 or name,
+        "src": "BB" if "BB" in (s4, s1) else "TD",
+    }
+
+def evaluate_candles(k4, k1):
+    """
+    Стадия расчёта (чистая функция, без сети и состояния):
+    -> (v4, z4, pat4, v1, z1, pat1, light)
+    """
+    have4 = bool(k4); have1 = bool(k1)
 
     # DeMarker по закрытым свечам
-    d4 = demarker_series(k4, DEM_LEN) if have4 else None
-    d1 = demarker_series(k1, DEM_LEN) if have1 else None
+    with span("demarker_series"):
+        d4 = demarker_series(k4, DEM_LEN) if have4 else None
+        d1 = demarker_series(k1, DEM_LEN) if have1 else None
 
     v4 = last_closed(d4) if d4 else None  # значение DeM на минус первой свече (4H)
     v1 = last_closed(d1) if d1 else None  # значение DeM на минус первой свече (1D)
@@ -625,26 +1098,41 @@ def process_symbol(kind, name):
     z1 = zone_of(v1, "1D")
 
     # Свечные паттерны для обычных 1TF-сигналов (pin-bar 40% / engulfing)
-    pat4 = candle_pattern(k4, z4) if have4 and z4 else False
-    pat1 = candle_pattern(k1, z1) if have1 and z1 else False
+    with span("candle_pattern"):
+        pat4 = candle_pattern(k4, z4) if have4 and z4 else False
+        pat1 = candle_pattern(k1, z1) if have1 and z1 else False
+
+    # ⚡ — 4H и 1D в одной зоне + любой из 4 свечных паттернов для молнии
+    light = False
+    if z4 and z1 and z4 == z1:
+        with span("lightning_has_pattern"):
+            light = lightning_has_pattern(k4 if have4 else None, z4, k1 if have1 else None, z1)
+
+    return (v4, z4, pat4, v1, z1, pat1, light)
+
+def dispatch_signals(f: Dict, rec) -> bool:
+    """
+    Стадия отправки: по результату evaluate_candles формируем сигналы и ключи дедупа.
+    """
+    k4, k1 = f["k4"], f["k1"]
+    have4 = bool(k4); have1 = bool(k1)
+    v4, z4, pat4, v1, z1, pat1, light = rec
 
     # Времена открытия последней закрытой свече на каждом ТФ
     open4 = k4[-1][0] if have4 else None
     open1 = k1[-1][0] if have1 else None
     dual  = max([x for x in (open4, open1) if x is not None]) if (open4 or open1) else None
 
-    sym = n4 or n1 or name
-    src = "BB" if "BB" in (s4, s1) else "TD"
+    sym = f["sym"]
+    src = f["src"]
 
     sent = False
 
-    # ⚡ — 4H и 1D в одной зоне + любой из 4 свечных паттернов для молнии
-    if z4 and z1 and z4 == z1:
-        if lightning_has_pattern(k4 if have4 else None, z4, k1 if have1 else None, z1):
-            sig = "LIGHT"
-            key = f"{sym}|{sig}|{z4}|{dual}|{src}"
-            if _broadcast_signal(format_signal(sym, sig, z4, src), key):
-                sent = True
+    if light:
+        sig = "LIGHT"
+        key = f"{sym}|{sig}|{z4}|{dual}|{src}"
+        if _broadcast_signal(format_signal(sym, sig, z4, src), key):
+            sent = True
 
     # 1TF4H — зона только на 4H + обычный паттерн на 4H
     if (not sent) and have4 and z4 and pat4 and not (z1 and z1 == z4):
@@ -670,9 +1158,233 @@ def process_symbol(kind, name):
 
     return sent
 
+def process_symbol(kind, name):
+    with span("process_symbol", name):
+        with span("fetch_symbol"):
+            f = fetch_symbol(kind, name)
+        if f is None:
+            return False
+        with span("evaluate_candles"):
+            rec = evaluate_candles(f["k4"], f["k1"])
+        with span("dispatch_signals"):
+            return dispatch_signals(f, rec)
+
+def is_bybit_symbol(kind, name) -> bool:
+    return kind == "CRYPTO" or name.endswith("USDT")
+
+# ================= CPU POOL =====================
+# Расчёт DeMarker/паттернов в отдельных процессах: свечи переводятся в плоский
+# float64 ещё в потоках загрузки и копируются в блок SharedMemory (строки [ts, o, h, l, c]),
+# воркерам передаются только смещения, они читают буфер через FlatOHLC,
+# обратно приходят компактные кортежи-записи.
+
+EVAL_POOL: Dict = {"pool": None, "fetch": None}
+
+def _eval_worker_init():
+    PROF["on"] = False
+    PROF["sampler"] = None
+
+def _eval_shm_jobs(shm_name: str, jobs: List):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        mv = shm.buf.cast("d")
+        try:
+            out = []
+            for off4, n4, off1, n1 in jobs:
+                k4 = FlatOHLC(mv, off4, n4) if n4 else None
+                k1 = FlatOHLC(mv, off1, n1) if n1 else None
+                out.append(evaluate_candles(k4, k1))
+            del k4, k1
+            return out
+        finally:
+            mv.release()
+    finally:
+        shm.close()
+
+def _eval_pool():
+    # forkserver: к моменту создания пула уже работают потоки загрузки/профилировщика,
+    # fork многопоточного процесса может унаследовать захваченный лок
+    if EVAL_POOL["pool"] is None:
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        EVAL_POOL["pool"] = ProcessPoolExecutor(
+            max_workers=EVAL_WORKERS, mp_context=ctx, initializer=_eval_worker_init
+        )
+    return EVAL_POOL["pool"]
+
+def _reset_eval_pool():
+    old = EVAL_POOL["pool"]
+    EVAL_POOL["pool"] = None
+    if old is not None:
+        try:
+            old.shutdown(wait=False, cancel_futures=True)
+        except:
+            pass
+
+def _fetch_pool():
+    if EVAL_POOL["fetch"] is None:
+        EVAL_POOL["fetch"] = ThreadPoolExecutor(max_workers=max(1, BB_FETCH_THREADS))
+    return EVAL_POOL["fetch"]
+
+def flat_ohlc(k) -> array:
+    """
+    Строки OHLC -> плоский float64 (одно преобразование, делается в потоке загрузки).
+    """
+    return array("d", chain.from_iterable(k or ()))
+
+def _fetch_flat(item) -> Optional[Dict]:
+    f = fetch_symbol(*item)
+    if f is not None:
+        f["a4"] = flat_ohlc(f["k4"])
+        f["a1"] = flat_ohlc(f["k1"])
+    return f
+
+def _shm_free() -> Optional[int]:
+    try:
+        st = os.statvfs(SHM_DIR)
+        return st.f_bavail * st.f_frsize
+    except:
+        return None
+
+def _pack_batch(batch: List[Dict]):
+    """
+    Кусок пачки -> один сегмент SharedMemory. (None, jobs), если в /dev/shm мало места:
+    нехватка tmpfs при записи даёт SIGBUS, который не перехватить.
+    """
+    arrs = []
+    jobs = []
+    pos = 0
+    for f in batch:
+        a4 = f.get("a4") if "a4" in f else flat_ohlc(f["k4"])
+        a1 = f.get("a1") if "a1" in f else flat_ohlc(f["k1"])
+        n4 = len(a4) // 5; n1 = len(a1) // 5
+        jobs.append((pos, n4, pos + n4, n1))
+        pos += n4 + n1
+        arrs.append(a4); arrs.append(a1)
+    size = max(1, pos * 5 * 8)
+    free = _shm_free()
+    if free is not None and size > free // 2:
+        return None, jobs
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    at = 0
+    for a in arrs:
+        nb = len(a) * 8
+        if nb:
+            shm.buf[at:at + nb] = memoryview(a).cast("B")
+            at += nb
+    return shm, jobs
+
+def _eval_inline(batch: List[Dict]) -> List:
+    return [evaluate_candles(f["k4"], f["k1"]) for f in batch]
+
+def evaluate_batch(batch: List[Dict]) -> List:
+    """
+    Расчёт пачки загруженных тикеров кусками по EVAL_CHUNK, в полёте не больше
+    2 × EVAL_WORKERS сегментов SharedMemory. При EVAL_WORKERS <= 0, нехватке
+    /dev/shm или сбое пула — в текущем процессе.
+    """
+    if EVAL_WORKERS <= 0 or len(batch) < 2:
+        return _eval_inline(batch)
+    step = max(1, EVAL_CHUNK)
+    chunks = [batch[i:i + step] for i in range(0, len(batch), step)]
+    res = [None] * len(chunks)
+    inflight = []
+
+    def drain():
+        ci, fut, shm = inflight.pop(0)
+        try:
+            res[ci] = fut.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    try:
+        with span("pool_eval"):
+            pool = _eval_pool()
+            for ci, chunk in enumerate(chunks):
+                while len(inflight) >= 2 * EVAL_WORKERS:
+                    drain()
+                with span("shm_pack"):
+                    shm, jobs = _pack_batch(chunk)
+                if shm is None:
+                    res[ci] = _eval_inline(chunk)
+                    continue
+                try:
+                    fut = pool.submit(_eval_shm_jobs, shm.name, jobs)
+                except:
+                    shm.close()
+                    shm.unlink()
+                    raise
+                inflight.append((ci, fut, shm))
+            while inflight:
+                drain()
+    except Exception as e:
+        print(f"WARN: eval pool failed ({e!r}), evaluating inline", flush=True)
+        if isinstance(e, BrokenProcessPool):
+            _reset_eval_pool()
+    finally:
+        for _, fut, shm in inflight:
+            fut.cancel()
+            shm.close()
+            shm.unlink()
+
+    out = []
+    for ci, chunk in enumerate(chunks):
+        out.extend(res[ci] if res[ci] is not None else _eval_inline(chunk))
+    return out
+
+# Последние закрытые свечи с прошлой загрузки: name -> (open 4H, open 1D).
+# Пока новая свеча не могла закрыться, тикер в пачку не берём.
+LAST_BARS: Dict = {}
+TF_SECONDS = {"4h": 14400, "1d": 86400}
+
+def bars_unchanged(kind, name) -> bool:
+    rec = LAST_BARS.get(name)
+    if not rec:
+        return False
+    now = CLOCK.time()
+    for t, iv in zip(rec, (KLINE_4H, KLINE_1D)):
+        tf = TF_SECONDS.get(iv)
+        if t is None:
+            continue
+        # последняя закрытая открылась в t, текущая закроется в t + 2*tf
+        if tf is None or now >= t + 2 * tf:
+            return False
+    return True
+
+def process_batch(items: List) -> int:
+    """
+    Пачка Bybit-тикеров: параллельная загрузка -> расчёт в пуле -> отправка.
+    Только для Bybit: лимиты TwelveData здесь не соблюдаются.
+    """
+    with span("process_batch"):
+        with span("fetch_symbol"):
+            res = list(_fetch_pool().map(_fetch_flat, items))
+        fetched = [f for f in res if f is not None]
+        for f in fetched:
+            LAST_BARS[f["name"]] = (
+                f["k4"][-1][0] if f["k4"] else None,
+                f["k1"][-1][0] if f["k1"] else None,
+            )
+        with span("evaluate_candles"):
+            recs = evaluate_batch(fetched)
+        sent = 0
+        with span("dispatch_signals"):
+            for f, rec in zip(fetched, recs):
+                if dispatch_signals(f, rec):
+                    sent += 1
+        return sent
+
 # ================= MAIN =====================
 
-def main():
+# Циклы по CLOCK: сколько было, сколько вышло за 60-секундный слот, максимум
+CYCLE_STATS: Dict = {"cycles": 0, "overruns": 0, "max": 0.0}
+
+def main(until: Optional[float] = None):
+    """
+    Основной цикл. until — момент (по CLOCK), после которого выходим (для симуляции).
+    """
+    install_profiler_signal()
     plan = build_plan()
     n = len(plan)
     print(f"INFO: Symbols loaded: {n}", flush=True)
@@ -682,45 +1394,64 @@ def main():
     else:
         print("WARN: empty plan, nothing to scan.", flush=True)
 
-    idx = STATE.get("plan_idx", 0)
-    if idx >= n:
-        idx = 0
-
     # Цикл: сканируем тикеры так, чтобы все прошли не реже 1 раза за 6 часов (360 минут),
     # при этом не превышая TD_MINUTE_LIMIT запросов в минуту.
-    while True:
-        start = time.time()
-        plan = build_plan()
+    # При EVAL_WORKERS > 0 Bybit-тикеры вынесены из этого слота в большие пачки для пула.
+    while until is None or CLOCK.time() < until:
+        start = CLOCK.time()
+        prof_cycle_begin()
+        with span("build_plan"):
+            plan = build_plan()
         n = len(plan)
         if n == 0:
-            time.sleep(60)
+            prof_cycle_end()
+            CLOCK.sleep(60)
             continue
-        if idx >= n:
-            idx = 0
-
-        # Сколько тикеров обрабатывать за одну "минуту":
-        # минимум ceil(n / 360), максимум TD_MINUTE_LIMIT, но не меньше 1.
-        symbols_per_minute = max(1, min(TD_MINUTE_LIMIT, (n + 360 - 1) // 360))
-
-        processed = 0
-        # Обрабатываем ограниченное число тикеров за слот
-        while processed < symbols_per_minute:
-            kind, name = plan[idx]
-            process_symbol(kind, name)
-            idx = (idx + 1) % n
-            processed += 1
-
-            # Промежуточная пауза, чтобы равномерно растянуть запросы
-            time.sleep(5)
-
-        STATE["plan_idx"] = idx
-        gc_state(STATE, 21)
-        save_state(STATE_PATH, STATE)
 
-        elapsed = time.time() - start
+        if EVAL_WORKERS > 0:
+            bb_plan = [x for x in plan if is_bybit_symbol(*x)]
+            slot_plan = [x for x in plan if not is_bybit_symbol(*x)]
+        else:
+            bb_plan = []
+            slot_plan = plan
+
+        if slot_plan:
+            # Сколько тикеров обрабатывать за одну "минуту":
+            # минимум ceil(n / 360), максимум TD_MINUTE_LIMIT, но не меньше 1.
+            n = len(slot_plan)
+            symbols_per_minute = max(1, min(TD_MINUTE_LIMIT, (n + 360 - 1) // 360))
+
+            with span("pick_symbols"):
+                items = take_next(slot_plan, "plan", symbols_per_minute)
+
+            # Обрабатываем ограниченное число тикеров за слот
+            for kind, name in items:
+                process_symbol(kind, name)
+
+                # Промежуточная пауза, чтобы равномерно растянуть запросы
+                with span("sleep"):
+                    CLOCK.sleep(5)
+
+        if bb_plan:
+            # Bybit: грузим пачку параллельно (только тикеры с новой закрытой свечой),
+            # считаем в пуле процессов
+            with span("pick_symbols"):
+                items = take_next(bb_plan, "bb", EVAL_BATCH, bars_unchanged)
+            process_batch(items)
+
+        with span("save_state"):
+            gc_state(STATE, 21)
+            save_state(STATE_PATH, STATE)
+        prof_cycle_end()
+
+        elapsed = CLOCK.time() - start
+        CYCLE_STATS["cycles"] += 1
+        CYCLE_STATS["max"] = max(CYCLE_STATS["max"], elapsed)
+        if elapsed > 60.0:
+            CYCLE_STATS["overruns"] += 1
         sleep_left = 60.0 - elapsed
         if sleep_left > 0:
-            time.sleep(sleep_left)
+            CLOCK.sleep(sleep_left)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,395 @@
+# sim.py — нагрузочный режим и бенчмарк пула для bot.py
+# Виртуальные часы + синтетический рынок в отдельном процессе, отвечающий
+# как Bybit (kline / instruments-info / tickers), TwelveData и Telegram.
+# Запуск:  python sim.py               — прогон SIM_DAYS виртуальных суток
+#          python sim.py --bench-eval  — масштабирование пула EVAL_WORKERS
+
+import os, sys, time, json, math, random, tempfile, threading, multiprocessing, requests
+from typing import List, Dict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import bot
+
+# ================= CONFIG =====================
+
+SIM_SYMBOLS      = int(os.getenv("SIM_SYMBOLS", "300"))
+SIM_DAYS         = float(os.getenv("SIM_DAYS", "3"))
+SIM_START        = int(os.getenv("SIM_START", "1704067200"))
+SIM_SEED         = os.getenv("SIM_SEED", "1")
+SIM_LATENCY_MS   = float(os.getenv("SIM_LATENCY_MS", "150"))
+SIM_ERROR_RATE   = float(os.getenv("SIM_ERROR_RATE", "0.01"))
+SIM_429_RATE     = float(os.getenv("SIM_429_RATE", "0.02"))
+
+SIM_TF = {"240": 14400, "D": 86400, "4h": 14400, "1day": 86400}
+
+# ================= CLOCK =====================
+
+class SimClock(bot.Clock):
+    """
+    Детерминированные часы: sleep() мгновенно сдвигает виртуальное время.
+    Потоки загрузки спят каждый на своей шкале (параллельные ожидания
+    перекрываются), основной поток при чтении догоняет самый дальний из них.
+    """
+    def __init__(self, start: float):
+        self.now = float(start)
+        self.horizon = float(start)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _main(self) -> bool:
+        return threading.current_thread() is threading.main_thread()
+
+    def time(self) -> float:
+        with self.lock:
+            if self._main():
+                self.now = max(self.now, self.horizon)
+                return self.now
+            return max(getattr(self.local, "t", 0.0), self.now)
+
+    def sleep(self, seconds: float):
+        if seconds <= 0:
+            return
+        with self.lock:
+            if self._main():
+                self.now = max(self.now, self.horizon) + seconds
+            else:
+                t = max(getattr(self.local, "t", 0.0), self.now) + seconds
+                self.local.t = t
+                self.horizon = max(self.horizon, t)
+
+class SimHTTP:
+    """
+    Подмена bot.requests: передаёт рынку виртуальное время (X-Sim-Time)
+    и спит в вызывающем потоке сетевую задержку из ответа (X-Sim-Latency).
+    """
+    RequestException = requests.RequestException
+
+    def __init__(self, clock: SimClock):
+        self.clock = clock
+
+    def _call(self, fn, url, **kw):
+        headers = dict(kw.pop("headers", None) or {})
+        headers["X-Sim-Time"] = repr(self.clock.time())
+        r = fn(url, headers=headers, **kw)
+        self.clock.sleep(float(r.headers.get("X-Sim-Latency") or 0))
+        return r
+
+    def get(self, url, **kw):
+        return self._call(requests.get, url, **kw)
+
+    def post(self, url, **kw):
+        return self._call(requests.post, url, **kw)
+
+# ================= SYNTHETIC MARKET =====================
+
+SIM_STATS: Dict = {"requests": {}, "429": 0, "errors": 0, "messages": 0}
+SIM_LOCK = threading.Lock()
+SIM_RNG = random.Random(SIM_SEED)
+
+SIM_PARAMS: Dict = {}
+BAR_CACHE: Dict = {}    # (sym, tf) -> {t0: [t0, o, h, l, c]} — закрытые свечи не меняются
+KLINE_FMT: Dict = {}    # (sym, tf) -> {t0: строка Bybit kline}
+MASK64 = (1 << 64) - 1
+
+def _sim_unit(x: int) -> float:
+    """
+    splitmix64: детерминированное равномерное [0, 1) от целого ключа.
+    """
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return ((x ^ (x >> 31)) >> 11) / float(1 << 53)
+
+def _sim_gauss(x: int) -> float:
+    u1 = _sim_unit(2 * x) or 1e-12
+    u2 = _sim_unit(2 * x + 1)
+    return math.sqrt(-2.0 * math.log(u1)) * math.cos(2 * math.pi * u2)
+
+def _sim_params(sym: str):
+    p = SIM_PARAMS.get(sym)
+    if p is None:
+        r = random.Random(f"{SIM_SEED}|{sym}")
+        p = (
+            r.getrandbits(48),
+            10 ** r.uniform(-1, 4),
+            r.uniform(0.02, 0.08), r.uniform(3, 9) * 86400, r.uniform(0, 2 * math.pi),
+            r.uniform(0.05, 0.20), r.uniform(20, 60) * 86400, r.uniform(0, 2 * math.pi),
+        )
+        SIM_PARAMS[sym] = p
+    return p
+
+def _sim_price(sym: str, t: float) -> float:
+    """
+    Цена как функция времени: два цикла (дни/недели) + шум в точке t.
+    Одна и та же точка даёт одну и ту же цену на любом ТФ.
+    """
+    h, base, a1, p1, f1, a2, p2, f2 = _sim_params(sym)
+    noise = 0.006 * _sim_gauss(h ^ (int(t) << 1))
+    x = a1 * math.sin(2 * math.pi * t / p1 + f1) + a2 * math.sin(2 * math.pi * t / p2 + f2)
+    return base * math.exp(x + noise)
+
+def _sim_bar(sym: str, tf: int, t0: int, t1: float) -> List[float]:
+    o = _sim_price(sym, t0)
+    c = _sim_price(sym, t1)
+    k = _sim_params(sym)[0] ^ (t0 * 7 + tf)
+    h = max(o, c) * (1 + abs(0.004 * _sim_gauss(k)))
+    l = min(o, c) * (1 - abs(0.004 * _sim_gauss(k + 1)))
+    return [t0, o, h, l, c]
+
+def sim_candles(sym: str, tf: int, limit: int, now: float) -> List[List[float]]:
+    """
+    limit последних свечей ТФ tf (сек.), последняя — текущая незакрытая.
+    Закрытые берутся из кэша, пересчитывается только открытая.
+    """
+    cur = int(now) // tf * tf
+    first = cur - (limit - 1) * tf
+    cache = BAR_CACHE.setdefault((sym, tf), {})
+    out = []
+    for t0 in range(first, cur, tf):
+        row = cache.get(t0)
+        if row is None:
+            row = cache[t0] = _sim_bar(sym, tf, t0, t0 + tf)
+        out.append(row)
+    out.append(_sim_bar(sym, tf, cur, now))
+    if len(cache) > limit + 64:
+        for t0 in [x for x in cache if x < first]:
+            del cache[t0]
+    return out
+
+def _kline_rows(sym: str, tf: int, limit: int, now: float) -> List[List[str]]:
+    fmt = KLINE_FMT.setdefault((sym, tf), {})
+    bars = sim_candles(sym, tf, limit, now)
+    out = []
+    for b in bars[:-1]:
+        row = fmt.get(b[0])
+        if row is None:
+            row = fmt[b[0]] = [str(b[0] * 1000)] + [f"{x:.8g}" for x in b[1:]]
+        out.append(row)
+    b = bars[-1]
+    out.append([str(b[0] * 1000)] + [f"{x:.8g}" for x in b[1:]])
+    if len(fmt) > limit + 64:
+        for t0 in [x for x in fmt if x < bars[0][0]]:
+            del fmt[t0]
+    out.reverse()
+    return out
+
+def _sim_symbols() -> List[str]:
+    return [f"SIM{i:04d}USDT" for i in range(SIM_SYMBOLS)]
+
+class SimMarketHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int, body: Dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Sim-Latency", f"{self.latency:.6f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fault(self, route: str) -> bool:
+        with SIM_LOCK:
+            SIM_STATS["requests"][route] = SIM_STATS["requests"].get(route, 0) + 1
+            x = SIM_RNG.random()
+            jitter = SIM_RNG.uniform(0.5, 1.5)
+        # сетевая задержка: её «проспит» клиент в виртуальном времени
+        self.latency = SIM_LATENCY_MS / 1000.0 * jitter
+        if x < SIM_429_RATE:
+            with SIM_LOCK:
+                SIM_STATS["429"] += 1
+            self._reply(429, {"retCode": 10006, "retMsg": "Too many visits!"})
+            return True
+        if x < SIM_429_RATE + SIM_ERROR_RATE:
+            with SIM_LOCK:
+                SIM_STATS["errors"] += 1
+            self._reply(500, {"retCode": 10016, "retMsg": "Server error"})
+            return True
+        return False
+
+    def do_GET(self):
+        self.latency = 0.0
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        now = float(self.headers.get("X-Sim-Time") or time.time())
+        if u.path == "/sim/stats":
+            with SIM_LOCK:
+                return self._reply(200, SIM_STATS)
+        if u.path.endswith("/v5/market/kline"):
+            if self._fault("bb_kline"):
+                return
+            tf = SIM_TF.get(q.get("interval"), 14400)
+            lst = _kline_rows(q.get("symbol", ""), tf, int(q.get("limit", 200)), now)
+            return self._reply(200, {"retCode": 0, "result": {"list": lst}})
+        if u.path.endswith("/v5/market/instruments-info"):
+            if self._fault("bb_instruments"):
+                return
+            lst = [{"symbol": x, "status": "Trading", "contractType": "LinearPerpetual",
+                    "quoteCoin": "USDT"} for x in _sim_symbols()]
+            return self._reply(200, {"retCode": 0, "result": {"list": lst, "nextPageCursor": ""}})
+        if u.path.endswith("/v5/market/tickers"):
+            if self._fault("bb_tickers"):
+                return
+            lst = []
+            for x in _sim_symbols():
+                w = _sim_unit(_sim_params(x)[0] + 1)
+                turnover = 0.0 if w < 0.1 else 10 ** (4 + 5 * w)
+                chg = _sim_price(x, now) / _sim_price(x, now - 86400) - 1
+                lst.append({"symbol": x, "turnover24h": str(turnover), "price24hPcnt": f"{chg:.6f}"})
+            return self._reply(200, {"retCode": 0, "result": {"list": lst}})
+        if u.path.endswith("/time_series"):
+            if self._fault("td_time_series"):
+                return
+            tf = SIM_TF.get(q.get("interval"), 14400)
+            bars = sim_candles(q.get("symbol", ""), tf, int(q.get("outputsize", 200)), now)
+            fmt = "%Y-%m-%d %H:%M:%S" if tf < 86400 else "%Y-%m-%d"
+            values = [{"datetime": time.strftime(fmt, time.gmtime(b[0])),
+                       "open": str(b[1]), "high": str(b[2]), "low": str(b[3]), "close": str(b[4])}
+                      for b in reversed(bars)]
+            return self._reply(200, {"status": "ok", "values": values})
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        self.latency = 0.0
+        n = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(n)
+        if self.path.endswith("/sendMessage"):
+            if self._fault("tg_send"):
+                return
+            with SIM_LOCK:
+                SIM_STATS["messages"] += 1
+            return self._reply(200, {"ok": True})
+        self._reply(404, {"ok": False})
+
+def _serve_market(conn):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), SimMarketHandler)
+    conn.send(srv.server_address[1])
+    conn.close()
+    srv.serve_forever()
+
+def start_sim_market():
+    """
+    Рынок в отдельном процессе: не делит GIL с ботом, отчёт меряет бота, а не стенд.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    proc = ctx.Process(target=_serve_market, args=(child,), daemon=True)
+    proc.start()
+    port = parent.recv()
+    return proc, f"http://127.0.0.1:{port}"
+
+# ================= RUN =====================
+
+def _sim_signal_lags(sent: Dict) -> List[float]:
+    """
+    Задержка сигнала (вирт. сек.) от закрытия свечи до отправки, по ключам дедупа:
+    sym|sig|zone|open|src|chat -> ts.
+    """
+    out = []
+    for k, ts in sent.items():
+        parts = k.split("|")
+        if len(parts) < 6 or parts[3] in ("", "None"):
+            continue
+        tf = 86400 if parts[1] == "1TF1D" else 14400
+        out.append(ts - (int(parts[3]) + tf))
+    return out
+
+def run_simulation():
+    """
+    Прогон SIM_DAYS виртуальных суток против синтетического рынка и отчёт:
+    запросы, 429/ошибки, сообщения, пропускная способность, циклы, задержка сигналов.
+    """
+    proc, base = start_sim_market()
+    clock = SimClock(SIM_START)
+    bot.CLOCK = clock
+    bot.requests = SimHTTP(clock)
+    bot.BB_KLINES = f"{base}/v5/market/kline"
+    bot.BB_INSTRUMENTS = f"{base}/v5/market/instruments-info"
+    bot.BB_TICKERS = f"{base}/v5/market/tickers"
+    bot.TD_BASE = base
+    bot.TD_API_KEY = bot.TD_API_KEY or "sim"
+    bot.TG_API = f"{base}/botsim"
+    bot.TELEGRAM_CHAT = "-100000000001"
+    bot.UNIVERSE_MODE = "bybit"
+    bot.STATE_PATH = os.path.join(tempfile.mkdtemp(prefix="demsim-"), "state.json")
+    bot.STATE = {"sent": {}, "last_debug": 0}
+
+    print(f"INFO: simulation {SIM_DAYS} days, {SIM_SYMBOLS} synthetic perps, market at {base}", flush=True)
+    try:
+        wall0 = time.perf_counter()
+        bot.main(until=SIM_START + SIM_DAYS * 86400)
+        wall = time.perf_counter() - wall0
+        stats = requests.get(f"{base}/sim/stats", timeout=10).json()
+    finally:
+        proc.terminate()
+
+    state = bot.STATE
+    cycles = bot.CYCLE_STATS
+    reqs = stats["requests"]
+    total = sum(reqs.values())
+    lags = sorted(_sim_signal_lags(state.get("sent", {})))
+    print(f"INFO: simulated {SIM_DAYS} days in {wall:.1f}s wall", flush=True)
+    print(f"INFO: requests {total} ({total / max(wall, 1e-9):.1f}/s wall) {json.dumps(reqs, sort_keys=True)}", flush=True)
+    print(f"INFO: 429={stats['429']} errors={stats['errors']} "
+          f"td_day_count={state.get('td_count', 0)} messages={stats['messages']}", flush=True)
+    print(f"INFO: cycles {cycles['cycles']}, over 60s slot {cycles['overruns']}, "
+          f"max {cycles['max']:.1f}s (virtual)", flush=True)
+    if lags:
+        p50 = lags[len(lags) // 2]
+        p95 = lags[min(len(lags) - 1, int(len(lags) * 0.95))]
+        print(f"INFO: signals {len(lags)}, lag after bar close p50={p50:.0f}s p95={p95:.0f}s max={lags[-1]:.0f}s", flush=True)
+
+def bench_eval():
+    """
+    Замер масштабирования пула: BENCH_SYMBOLS синтетических тикеров × (4H + 1D),
+    inline против пула на 1..cpu_count процессов, плюс последовательная доля
+    (перевод во float64 в потоках загрузки и упаковка куска в SharedMemory).
+    """
+    count = int(os.getenv("BENCH_SYMBOLS", "1000"))
+    now = SIM_START + 30 * 86400
+    batch = []
+    for i in range(count):
+        sym = f"SIM{i:05d}USDT"
+        batch.append({
+            "k4": bot.closed_ohlc(sim_candles(sym, 14400, 600, now)),
+            "k1": bot.closed_ohlc(sim_candles(sym, 86400, 600, now)),
+        })
+    BAR_CACHE.clear()
+
+    t0 = time.perf_counter()
+    ref = bot._eval_inline(batch)
+    t_inline = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for f in batch:
+        f["a4"] = bot.flat_ohlc(f["k4"]); f["a1"] = bot.flat_ohlc(f["k1"])
+    t_flat = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for i in range(0, count, max(1, bot.EVAL_CHUNK)):
+        shm, _ = bot._pack_batch(batch[i:i + bot.EVAL_CHUNK])
+        if shm is not None:
+            shm.close(); shm.unlink()
+    t_pack = time.perf_counter() - t0
+
+    print(f"INFO: {count} symbols x 2 TF, cpu={os.cpu_count()}: inline {t_inline:.2f}s, "
+          f"to-float64 {t_flat:.2f}s (fetch threads), shm pack {t_pack:.3f}s", flush=True)
+    cpus = os.cpu_count() or 1
+    for workers in sorted(set([cpus] + [2 ** i for i in range(8) if 2 ** i <= cpus])):
+        bot.EVAL_WORKERS = workers
+        bot._reset_eval_pool()
+        bot.evaluate_batch(batch[:workers * 2])  # прогрев процессов
+        t0 = time.perf_counter()
+        out = bot.evaluate_batch(batch)
+        t = time.perf_counter() - t0
+        bot._reset_eval_pool()
+        print(f"INFO: workers={workers} {t:.2f}s speedup x{t_inline / t:.2f} "
+              f"match={out == ref}", flush=True)
+
+if __name__ == "__main__":
+    if "--bench-eval" in sys.argv[1:]:
+        bench_eval()
+    else:
+        run_simulation()